@@ -1,93 +1,201 @@
+import collections.abc
+import functools
+import logging
+import re
+
 from migen import *
 from migen.fhdl.decorators import ResetInserter
 from litex.soc.interconnect.csr import CSRStorage, CSRStatus
 
+logger = logging.getLogger(__name__)
+
+# Lowercase ASCII identifiers that don't start with an underscore
+_FIELD_NAME_RE = re.compile(r"[a-z][a-z0-9_]*\Z")
+
+# Implicit single Fields for registers created without any, keyed by (name, size)
+_DEFAULT_FIELD_CACHE = {}
 
 def get_size_and_fields(size, fields, default_name):
     """The first argument can be either a number or a Field.  If it's a Field,
     transform the size into "None" (i.e. "guess"), then fold the size into
-    the fields list."""
-    size_is_field = False
-    _fields = []
-    if not isinstance(size, int):
-        # print("Size is not int, it's {}".format(size.__class__))
-        size_is_field = True
-
-    for f in fields:
-        # print("Copying field: {}".format(f))
-        _fields.append(f)
-
-    if len(_fields) == 0 and not size_is_field:
-        # print("Adding default field")
-        _fields.append(Field(default_name, size=size, offset=0, hidden=True))
-    if size_is_field:
-        _fields.insert(0, size)
-        size = None
+    the fields list.  Any other type of size raises a TypeError."""
+    if isinstance(size, Field):
+        return (None, [size, *fields])
+
+    _fields = list(fields)
+    if size is None:
+        if len(_fields) == 0:
+            raise ValueError("'size' must be specified for a register with no fields")
+    elif not isinstance(size, int):
+        raise TypeError(f"'size' must be an int, a Field, or None, not {type(size).__name__}")
+    elif len(_fields) == 0:
+        key = (default_name, size)
+        field = _DEFAULT_FIELD_CACHE.get(key)
+        if field is None:
+            # The name is ours, but the size came from the caller
+            if size < 1:
+                raise ValueError("'size' must be >= 1")
+            field = _DEFAULT_FIELD_CACHE[key] = Field._unchecked(default_name, size, 0, hidden=True)
+        _fields.append(field)
     return (size, _fields)
 
-def get_bit_list(fields):
-    bits = []
+@functools.lru_cache(maxsize=None)
+def resolve_layout(shape, width=None):
+    """Place each (name, size, offset) entry in `shape` within a register
+    that is `width` bits wide, or just wide enough if `width` is None.
+    Returns a tuple of the resolved offsets, the total number of bits,
+    and the (offset, size) of each run of unused bits.  Raises a
+    ValueError if any fields overlap or don't fit."""
+    offsets = []
     current_offset = 0 # Running counter of which bit we're on
-    # Figure out how many bits we'll need
-    for field in fields:
-        if field.offset is not None:
-            current_offset = field.offset
-        field.offset = current_offset
-        for bit in range(current_offset, current_offset + field.size):
-            while len(bits) <= bit:
-                bits.append(None)
-            if len(bits) == bit and bits[bit] is not None:
-                raise ValueError("Register has overlapping fields: {} overlaps with {} at bit {}".format(field.name, bits[bit].name, bit))
-            bits[bit] = field
-        current_offset = current_offset + field.size
-    return bits
-
-class DCSRSignals(dict):
-    __getattr__ = dict.__getitem__
+    total_bits = 0
+    used_mask = 0 # Bit n is set once a field has claimed bit n
+    for (name, size, offset) in shape:
+        if offset is not None:
+            current_offset = offset
+        field_mask = ((1 << size) - 1) << current_offset
+        overlap = used_mask & field_mask
+        if overlap:
+            bit = (overlap & -overlap).bit_length() - 1
+            other = next(n for ((n, s, _), o) in zip(shape, offsets) if o <= bit < o + s)
+            raise ValueError(f"Register has overlapping fields: {name} overlaps with {other} at bit {bit}")
+        used_mask |= field_mask
+        offsets.append(current_offset)
+        current_offset = current_offset + size
+        total_bits = max(total_bits, current_offset)
+    if width is not None:
+        if total_bits > width:
+            raise ValueError(f"Register fields need {total_bits} bits, but its size is {width}")
+        total_bits = width
+
+    # Now that nothing overlaps, find the runs of bits that no field covers
+    gaps = []
+    next_offset = 0
+    for (start, size) in sorted(zip(offsets, (size for (_, size, _) in shape))):
+        if start > next_offset:
+            gaps.append((next_offset, start - next_offset))
+        next_offset = start + size
+    if next_offset < total_bits:
+        gaps.append((next_offset, total_bits - next_offset))
+    return (tuple(offsets), total_bits, tuple(gaps))
+
+class Layout:
+    """The placement of every Field within a register.
 
-class DCSR:
-    def make_storage_signals(self, bits):
-        signals = DCSRSignals()
-        seen_fields = set()
-
-        for field in bits:
-            if field is None:
-                signals.append(Signal())
-                continue
-            if field.name in seen_fields:
-                continue
-            seen_fields.add(field.name)
+    Attributes:
+        fields (:obj:`list` of (:obj:`Field`, int)): Each Field with its resolved offset.
+        width (int): Total number of bits in the register.
+        gaps (:obj:`tuple` of (int, int)): The (offset, size) of each run of unused bits.
+    """
+    __slots__ = ("fields", "width", "gaps")
+
+    def __init__(self, fields, width, gaps):
+        self.fields = fields
+        self.width = width
+        self.gaps = gaps
+
+def resolve_fields(fields, size=None):
+    """Work out where each Field sits within a register of `size` bits,
+    returning a :obj:`Layout`.  The Fields themselves are left untouched,
+    so they may be shared."""
+    shape = tuple((field.name, field.size, field.offset) for field in fields)
+    (offsets, width, gaps) = resolve_layout(shape, size)
+    return Layout(list(zip(fields, offsets)), width, gaps)
+
+class DCSRSignals(collections.abc.Mapping):
+    """A fixed, read-only mapping of field names to Signals.
+
+    Each field is stored in a slot, so `signals.name` is a plain attribute
+    load.  It is also a :obj:`collections.abc.Mapping`, so `signals["name"]`,
+    `keys()`, `items()`, `get()` and the rest still work for code that
+    treats it as a dict.  Fields may not share a name with any of these
+    methods, since the slot would hide the method."""
+    __slots__ = ()
+    _names = frozenset() # The slot names, for constant-time membership tests
+
+    def __getitem__(self, name):
+        if name not in self._names:
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def __contains__(self, name):
+        return name in self._names
+
+    def __iter__(self):
+        return iter(self.__slots__)
+
+    def __len__(self):
+        return len(self.__slots__)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({dict(self.items())!r})"
+
+# Names that a field slot would shadow on a DCSRSignals
+_RESERVED_SIGNAL_NAMES = frozenset(dir(DCSRSignals))
+
+# DCSRSignals subclasses, keyed by the tuple of names they hold
+_SIGNALS_CLASSES = {}
+
+def make_signals(pairs):
+    """Create a :obj:`DCSRSignals` holding each (name, signal) entry in `pairs`."""
+    names = tuple(name for (name, _) in pairs)
+    cls = _SIGNALS_CLASSES.get(names)
+    if cls is None:
+        seen = set()
+        for name in names:
+            if name in seen:
+                raise ValueError(f"Register has more than one field named {name}")
+            if name in _RESERVED_SIGNAL_NAMES:
+                raise ValueError(f"Field name {name} is reserved, since it would hide DCSRSignals.{name}")
+            seen.add(name)
+        cls = type("DCSRSignals", (DCSRSignals,),
+                   {"__slots__": names, "_names": frozenset(names)})
+        _SIGNALS_CLASSES[names] = cls
+    signals = cls()
+    for (name, signal) in pairs:
+        setattr(signals, name, signal)
+    return signals
 
-            signal = Signal(field.size)
-            self.comb += signal.eq(self.storage >> field.offset)
+class DCSR:
+    def make_storage_signals(self, layout):
+        signals = []
 
+        # Mask every pulsed field at once, so they read as 0 unless `re` is set
+        pulse_mask = 0
+        for (field, offset) in layout.fields:
+            if field.pulse:
+                pulse_mask |= ((1 << field.size) - 1) << offset
+        if pulse_mask:
+            all_mask = (1 << layout.width) - 1
+            mask = Mux(self.re, Constant(all_mask, layout.width),
+                                Constant(all_mask ^ pulse_mask, layout.width))
+            pulsed_storage = Signal(layout.width)
+            self.comb += pulsed_storage.eq(self.storage & mask)
+
+        # Fields are only read, so slices of `storage` need no Signals of their own
+        for (field, offset) in layout.fields:
+            name = field.name
+            end = offset + field.size
             if field.pulse:
-                signal_pulsed = Signal(field.size)
-                self.comb += signal_pulsed.eq(signal & Replicate(self.re, field.size))
-                signals[field.name + "_raw"] = signal
-                signals[field.name] = signal_pulsed
+                signals.append((name + "_raw", self.storage[offset:end]))
+                signals.append((name, pulsed_storage[offset:end]))
             else:
-                signals[field.name] = signal
-        self.r = signals
+                signals.append((name, self.storage[offset:end]))
+        self.r = make_signals(signals)
 
-    def make_status_signals(self, bits):
-        signals = DCSRSignals()
-        signal_list = []
-        seen_fields = set()
+    def make_status_signals(self, layout):
+        signals = []
+        statements = []
 
-        for field in bits:
-            if field is None:
-                signal_list.append(Signal())
-                continue
-            if field.name in seen_fields:
-                continue
-            seen_fields.add(field.name)
-
-            signal = Signal(field.size)
-            signals[field.name] = signal
-            signal_list.append(signal)
-        self.w = signals
-        self.comb += self.status.eq(Cat(*signal_list))
+        for (field, offset) in layout.fields:
+            size = field.size
+            signal = Signal(size)
+            signals.append((field.name, signal))
+            statements.append(self.status[offset:offset + size].eq(signal))
+        for (offset, size) in layout.gaps:
+            statements.append(self.status[offset:offset + size].eq(0))
+        self.comb += statements
+        self.w = make_signals(signals)
 
 
 class DCSRStorage(CSRStorage, DCSR):
@@ -125,11 +233,17 @@ class DCSRStorage(CSRStorage, DCSR):
             If constructed with `reset=True`, this signal can be written
             in order to reset the underlying storage, even if the storage
             is not normally writeable.
-        r (:obj:`dict` of :obj:`Signal()`): Dictionary containing all incoming `Field`s.
-            If this CSR is `readable`, then this dictionary contains one
+        r (:obj:`DCSRSignals`): Collection of all incoming `Field`s.
+            If this CSR is `readable`, then this mapping contains one
             entry for each :obj:`Field` that is present.  These are all readable.
-        w (:obj:`dict` of :obj:`Signal()`): Dictionary containing all outgoing `Field`s.
-            If this CSR is `writable`, then this dictionary contains one
+            Entries are read-only slices of `storage` rather than :obj:`Signal`
+            objects, so Signal-only attributes such as `reset` and
+            `name_override` are not available on them.  For a `pulse` field,
+            the entry is instead a slice of an internal copy of `storage` that
+            reads as 0 unless `re` is set, and `<name>_raw` is the slice of
+            `storage` itself.
+        w (:obj:`DCSRSignals`): Collection of all outgoing `Field`s.
+            If this CSR is `writable`, then this mapping contains one
             entry for each :obj:`Field` that is present.  These are all writeable.
     """
     def __init__(self,
@@ -173,13 +287,16 @@ class DCSRStorage(CSRStorage, DCSR):
         """
         
         (size, fields) = get_size_and_fields(size, fields, "storage")
-        bits = get_bit_list(fields)
+        layout = resolve_fields(fields, size)
 
         try:
-            CSRStorage.__init__(self, len(bits), reset=reset, name=name,
+            CSRStorage.__init__(self, layout.width, reset=reset, name=name,
                                         atomic_write=atomic, write_from_dev=writeable)
-        except Exception as e:
-            raise ValueError("Cannot extract Reg name from code -- please provide one by passing `name=` to the initializer: {}".format(e))
+        except ValueError as e:
+            # Only a failed name lookup deserves the friendlier message
+            if name is not None:
+                raise
+            raise ValueError(f"Cannot extract Reg name from code -- please provide one by passing `name=` to the initializer: {e}") from e
 
         if resettable:
             self.reset = Signal(1, reset=0)
@@ -187,9 +304,9 @@ class DCSRStorage(CSRStorage, DCSR):
         
         if writeable:
             self.status = self.storage.dat_w
-            self.make_status_signals(bits)
+            self.make_status_signals(layout)
 
-        self.make_storage_signals(bits)
+        self.make_storage_signals(layout)
 
 class DCSRStatus(CSRStatus, DCSR):
     """DCSRStatus: Documented CSRStatus object
@@ -214,8 +331,8 @@ class DCSRStatus(CSRStatus, DCSR):
             If constructed with `reset=True`, this signal can be written
             in order to reset the underlying storage, even if the storage
             is not normally writeable.
-        w (:obj:`dict` of :obj:`Signal()`): Dictionary containing all outgoing `Field`s.
-            If this CSR is `wirable`, then this dictionary contains one
+        w (:obj:`DCSRSignals`): Collection of all outgoing `Field`s.
+            If this CSR is `wirable`, then this mapping contains one
             entry for each :obj:`Field` that is present.  These are all writeable.
     """
     def __init__(self,
@@ -258,16 +375,22 @@ class DCSRStatus(CSRStatus, DCSR):
         """
         
         (size, fields) = get_size_and_fields(size, fields, "status")
-        bits = get_bit_list(fields)
+        layout = resolve_fields(fields, size)
 
         try:
-            CSRStatus.__init__(self, len(bits), reset=reset, name=name)
-        except Exception as e:
-            raise ValueError("Cannot extract CSRStatus name from code -- please provide one by passing `name=` to the initializer: {}".format(e))
-        self.make_status_signals(bits)
+            CSRStatus.__init__(self, layout.width, reset=reset, name=name)
+        except ValueError as e:
+            # Only a failed name lookup deserves the friendlier message
+            if name is not None:
+                raise
+            raise ValueError(f"Cannot extract CSRStatus name from code -- please provide one by passing `name=` to the initializer: {e}") from e
+        self.make_status_signals(layout)
 
 class Field:
     """Describes a Field for use in a :obj:`CSRStorage` or :obj:`CSRStatus`"""
+    __slots__ = ("name", "size", "offset", "description", "readable", "writeable",
+                 "pulse", "values", "hidden", "min", "max")
+
     def __init__(self, name, size=1, offset=None, description=None, values=None,
                              min=None, max=None,
                              pulse=False, readable=True, writeable=True, hidden=False):
@@ -275,7 +398,10 @@ class Field:
 
         Args:
             name (:obj:`str`): The name of this field.
-                Names must be valid Python identifiers, and must be all lower-case.
+                Names may only contain lowercase ASCII letters, digits, and `_`, and
+                must start with a letter.  Upper-case letters are made lowercase, with
+                a warning.  Names may not be the name of
+                a :obj:`DCSRSignals` method such as `keys`, `items`, `values` or `get`.
             size (int): How many bits wide to make this field.
                 Fields must be at least one bit wide, and have no maximum width.
             offset (int): Where to position this field within the :obj:`DCSR`.
@@ -315,11 +441,14 @@ class Field:
                 in a register and you'd prefer to put the documentation at the
                 register level.
         """
-        if not name.isidentifier():
-            raise ValueError("{} is not a valid Python identifier".format(name))
-        if True in map(lambda l: l.isupper(), name):
-            print("WARNING: name {} will be made lowercase".format(name))
-            name = name.lower()
+        lower_name = name.lower()
+        if not _FIELD_NAME_RE.match(lower_name):
+            raise ValueError(f"{name} is not a valid field name: names may only contain lowercase "
+                             "ASCII letters, digits, and '_', and must start with a letter "
+                             "(upper-case letters are made lowercase)")
+        if lower_name != name:
+            logger.warning("name %s will be made lowercase", name)
+            name = lower_name
 
         # Esnure that a size is specified
         if not isinstance(size, int):
@@ -348,4 +477,26 @@ class Field:
         self.values = values
         self.hidden = hidden
         self.min = min
-        self.max = max
\ No newline at end of file
+        self.max = max
+
+    @classmethod
+    def _unchecked(cls, name, size, offset, description=None, values=None,
+                             min=None, max=None,
+                             pulse=False, readable=True, writeable=True, hidden=False):
+        """Create a :obj:`Field` without validating any arguments.
+
+        This is for Fields built internally from values that are already
+        known to be good.  User-supplied Fields should use the constructor."""
+        field = cls.__new__(cls)
+        field.name = name
+        field.size = size
+        field.offset = offset
+        field.description = description
+        field.readable = readable
+        field.writeable = writeable
+        field.pulse = pulse
+        field.values = values
+        field.hidden = hidden
+        field.min = min
+        field.max = max
+        return field
\ No newline at end of file